@@ -1,19 +1,165 @@
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from requests.utils import DEFAULT_CA_BUNDLE_PATH
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+from urllib3.util.ssl_ import create_urllib3_context
+import hashlib
 import json
-from flask import Flask, jsonify, request
-from flask_cors import CORS
+import orjson
+from flask import Flask, current_app, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.routing import BaseConverter
+import atexit
+import brotli
+import gzip
 import logging
-from datetime import datetime, timedelta
+import queue
+import socket
+import stat
+from logging.handlers import QueueHandler, QueueListener
+from datetime import datetime
+from email.utils import parsedate_to_datetime
 import time
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from contextlib import contextmanager
 from functools import wraps
 
+try:
+    import fcntl
+except ImportError:  # Windows: снапшот без межпроцессной блокировки
+    fcntl = None
+
 # Настройка логирования
-logging.basicConfig(level=logging.INFO)
+# Потоки запросов только кладут запись в очередь, в stdout пишет фоновый поток
+log_queue = queue.Queue(-1)
+log_listener = QueueListener(log_queue, logging.StreamHandler())
+# OCS_DEBUG=1 включает подробные логи (попадания в кэш, ответы OCS) без правки кода
+LOG_LEVEL = logging.DEBUG if os.getenv('OCS_DEBUG') == '1' else logging.INFO
+logging.basicConfig(level=LOG_LEVEL, handlers=[QueueHandler(log_queue)])
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON-провайдер Flask на orjson: jsonify сериализует в C, а не в stdlib json"""
+    
+    # Порядок ключей сохраняем как есть — сортировка на каждом ответе не нужна
+    sort_keys = False
+    
+    def dumps_bytes(self, obj, indent=False):
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option)
+    
+    def dumps(self, obj, **kwargs):
+        return self.dumps_bytes(obj, kwargs.get('indent')).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        """jsonify без промежуточной str: тело ответа — bytes прямо из orjson"""
+        # Аргументы разбираем как jsonify: один объект, несколько — списком, или kwargs
+        if args and kwargs:
+            raise TypeError('app.json.response() takes either args or kwargs, not both')
+        obj = args[0] if len(args) == 1 else (args or kwargs or None)
+        indent = (self.compact is None and current_app.debug) or self.compact is False
+        return current_app.response_class(self.dumps_bytes(obj, indent), mimetype=self.mimetype)
+
+class OCSIdConverter(BaseConverter):
+    """Код категории или товара OCS: только буквы, цифры, _ и -.
+
+    Значение подставляется в путь запроса к OCS, поэтому '..' и прочее
+    отсекаются ещё при роутинге (404) — без обращения к upstream.
+    """
+    regex = r'[\w-]+'
+
 app = Flask(__name__)
-CORS(app)
+app.json = OrjsonProvider(app)
+app.url_map.converters['ocs_id'] = OCSIdConverter
+
+# CORS-заголовки одинаковы для всех ответов — собираем их один раз
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
+    'Access-Control-Allow-Methods': 'GET,OPTIONS',
+    # Без этого браузер с другого origin не даст скрипту прочитать ETag и X-Cache
+    'Access-Control-Expose-Headers': 'ETag, X-Cache',
+}
+
+# Браузер кэширует preflight на сутки и не шлёт OPTIONS перед каждым запросом
+PREFLIGHT_HEADERS = {'Access-Control-Max-Age': '86400'}
+
+@app.before_request
+def handle_preflight():
+    """Preflight к существующей ручке — пустой 204 без вызова самой ручки.
+
+    Роутинг к этому моменту уже отработал: OPTIONS на неизвестный путь
+    (url_rule is None) пропускаем дальше, к обычным 404/405.
+    """
+    if request.method == 'OPTIONS' and request.url_rule is not None:
+        return app.response_class(status=204, headers=PREFLIGHT_HEADERS)
+
+@app.after_request
+def add_cors_headers(response):
+    response.headers.update(CORS_HEADERS)
+    return response
+
+# JSON меньше этого размера не сжимаем: выигрыш не окупает CPU
+COMPRESS_MIN_SIZE = 1024
+
+# Сжатые тела ответов с сильным ETag: (ETag, кодировка) -> bytes. Повторный ответ
+# из кэша не сжимает мегабайты заново; при переполнении начинаем заново
+compressed_bodies = {}
+COMPRESSED_BODIES_MAX = 32
+
+@app.after_request
+def compress_response(response):
+    """Сжимаем крупные JSON-ответы (каталог товаров) в br или gzip по Accept-Encoding"""
+    if (response.status_code != 200 or response.direct_passthrough
+            or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers):
+        return response
+    
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    accept = request.accept_encodings
+    if 'br' in accept:
+        encoding = 'br'
+    elif 'gzip' in accept:
+        encoding = 'gzip'
+    else:
+        return response
+    
+    # Сильный ETag однозначно задаёт тело — по нему берём уже сжатую копию
+    etag, weak = response.get_etag()
+    key = (etag, encoding) if etag and not weak else None
+    compressed = compressed_bodies.get(key) if key else None
+    if compressed is None:
+        if encoding == 'br':
+            compressed = brotli.compress(data, quality=4)
+        else:
+            compressed = gzip.compress(data, compresslevel=5)
+        if key:
+            if len(compressed_bodies) >= COMPRESSED_BODIES_MAX:
+                compressed_bodies.clear()
+            compressed_bodies[key] = compressed
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    
+    # Сжатое тело отличается побайтно — ETag остаётся, но становится слабым
+    if key:
+        response.set_etag(etag, weak=True)
+    return response
 
 # Конфигурация
 API_KEY = os.getenv('OCS_API_KEY')
@@ -21,7 +167,57 @@ BASE_URL = 'https://connector.b2b.ocs.ru/api/v2'
 
 # Кэш с TTL
 cache = {}
-CACHE_TTL = 300  # 5 минут
+# Когда запись кэша последний раз отдавали клиенту: refresh-ahead обновляет только читаемые
+cache_hits = {}
+CACHE_TTL = 300  # 5 минут — по умолчанию
+CACHE_MAX_ENTRIES = 2048
+
+# TTL по типу данных: справочники меняются редко, цены и остатки — часто
+CACHE_TTLS = {
+    'categories_tree': 1800,
+    'categories_light': 1800,
+    'shipment_cities': 3600,
+    'currency_exchanges': 300,
+    'products': 300,
+    'product': 300,
+}
+
+# Ошибку OCS помним несколько секунд: повторные запросы не гоняют ретраи по упавшему upstream
+NEGATIVE_CACHE_TTL = 5
+failed_requests = {}
+
+def _private_snapshot_dir():
+    """Каталог снапшотов, доступный только текущему пользователю.
+
+    Общий /tmp с фиксированными именами не годится: любой процесс на хосте мог бы
+    подложить дерево категорий или держать блокировку. В имени — uid и путь к
+    приложению, чтобы два деплоя на одном хосте не делили снапшоты.
+    """
+    configured = os.getenv('OCS_SNAPSHOT_DIR')
+    if configured:
+        return configured
+    uid = os.getuid() if hasattr(os, 'getuid') else None
+    app_id = hashlib.blake2b(os.path.dirname(os.path.abspath(__file__)).encode(), digest_size=4).hexdigest()
+    base = os.getenv('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    path = os.path.join(base, f'ocs-api-{uid}-{app_id}')
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    except OSError as e:
+        logger.warning(f"Cannot create snapshot dir {path}: {str(e)}")
+        return tempfile.mkdtemp(prefix='ocs-api-')
+    # Каталог с таким именем мог заранее создать кто-то другой
+    st = os.lstat(path)
+    if uid is not None and (not stat.S_ISDIR(st.st_mode) or st.st_uid != uid or st.st_mode & 0o077):
+        logger.warning(f"Snapshot dir {path} is not private, using a per-process one")
+        return tempfile.mkdtemp(prefix='ocs-api-')
+    return path
+
+# Общие для воркеров gunicorn снапшоты тяжёлых ответов (дерево категорий)
+SNAPSHOT_DIR = _private_snapshot_dir()
+# Дольше блокировку снапшота не ждём: воркер, который за ним пошёл, завис на OCS
+SNAPSHOT_LOCK_TIMEOUT = 30
 
 # Статистика запросов для мониторинга проблемных категорий
 request_stats = {}
@@ -31,6 +227,39 @@ MAX_CATEGORIES = 405          # Было: 20
 MAX_PRODUCTS_PER_REQUEST = 5000  # Было: 100
 MAX_PAGINATION_PER_PAGE = 500    # Для пагинации (баланс производительности)
 
+# Категории с тысячами товаров: больше ретраев и таймаут
+HEAVY_CATEGORIES = frozenset({'V08', 'V09', 'V02', 'V05'})
+
+# Необязательные фильтры товаров, которые пробрасываем в OCS как есть
+OPTIONAL_PRODUCT_PARAMS = ('locations', 'producers', 'includesale', 'includeuncondition', 'includemissing')
+# Фильтры-списки: ?producers=A&producers=B уходят в OCS всеми значениями
+MULTI_VALUE_PRODUCT_PARAMS = frozenset({'locations', 'producers'})
+
+# Пул соединений к OCS: Flask threaded=True + пул воркеров для параллельных запросов
+HTTP_POOL_MAXSIZE = 32
+
+# Таймаут установки соединения один для всех запросов: недоступный OCS обнаруживаем
+# быстро. Бюджет на чтение задаётся по эндпоинту — большие ответы читаются долго.
+CONNECT_TIMEOUT = 5
+
+# Коды ответа OCS, при которых имеет смысл повторить запрос
+TRANSIENT_STATUS_CODES = frozenset({500, 502, 503, 504})
+# OCS просит подождать (таймаут запроса, rate limit): повторяем после Retry-After.
+# Если ждать дольше MAX_RETRY_AFTER секунд, не ретраим — отдаём ошибку сразу
+THROTTLE_STATUS_CODES = frozenset({408, 429})
+MAX_RETRY_AFTER = 10
+
+# Дольше ждать чужой запрос в OCS по тому же ключу не стоит: тяжёлая категория с
+# ретраями может занять минуты, а ожидающий держит соединение воркера
+SINGLE_FLIGHT_TIMEOUT = 25
+
+# Circuit breaker: после стольких запросов, исчерпавших ретраи за CIRCUIT_WINDOW_SECONDS
+# без единого удачного ответа, OCS считаем недоступным и CIRCUIT_OPEN_SECONDS не ходим
+# в него, отвечая из кэша или ошибкой. Редкие сбои, разнесённые во времени, цепь не размыкают
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_WINDOW_SECONDS = 60
+CIRCUIT_OPEN_SECONDS = 30
+
 def log_statistics(category, success, response_time):
     """Логируем статистику по запросам"""
     if category not in request_stats:
@@ -54,9 +283,222 @@ def log_statistics(category, success, response_time):
     else:
         stats['failures'] += 1
 
+def parse_retry_after(value):
+    """Retry-After в секундах (число или HTTP-дата); None, если заголовка нет или он битый"""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return max(seconds, 0.0)
+
+def cache_get(key, kind):
+    """Данные из кэша, если TTL для этого типа данных не истёк, иначе None"""
+    entry = cache.get(key)
+    if entry is not None:
+        data, timestamp = entry
+        now = time.time()
+        if now - timestamp < CACHE_TTLS.get(kind, CACHE_TTL):
+            cache_hits[key] = now
+            return data
+    return None
+
+def cache_set(key, data, timestamp=None):
+    if key not in cache and len(cache) >= CACHE_MAX_ENTRIES:
+        _evict_cache()
+    cache[key] = (data, time.time() if timestamp is None else timestamp)
+
+def cache_get_stale(key):
+    """Последний удачный ответ без учёта TTL — отдаём его, когда OCS вернул ошибку"""
+    entry = cache.get(key)
+    return entry[0] if entry is not None else None
+
+def negative_cache_get(key):
+    """Недавняя ошибка OCS по этому ключу, если её срок ещё не вышел"""
+    entry = failed_requests.get(key)
+    if entry is not None and time.time() < entry[1]:
+        return entry[0]
+    return None
+
+def negative_cache_set(key, error):
+    if len(failed_requests) >= CACHE_MAX_ENTRIES:
+        failed_requests.clear()
+    failed_requests[key] = (error, time.time() + NEGATIVE_CACHE_TTL)
+
+def _evict_cache():
+    """Освобождаем место: сначала протухшие записи, затем самые старые"""
+    now = time.time()
+    entries = list(cache.items())
+    expired = [key for key, (_, timestamp) in entries
+               if now - timestamp >= max(CACHE_TTLS.values())]
+    if not expired:
+        entries.sort(key=lambda item: item[1][1])
+        expired = [key for key, _ in entries[:max(1, len(entries) // 10)]]
+    for key in expired:
+        cache.pop(key, None)
+        cache_hits.pop(key, None)
+
+def _snapshot_path(name, suffix='json'):
+    return os.path.join(SNAPSHOT_DIR, f'ocs_{name}.{suffix}')
+
+def read_snapshot(name, ttl, suffix='json'):
+    """Свежий снапшот, записанный любым воркером: (data, timestamp) или None"""
+    path = _snapshot_path(name, suffix)
+    try:
+        timestamp = os.path.getmtime(path)
+        if time.time() - timestamp >= ttl:
+            return None
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read()), timestamp
+    except (OSError, orjson.JSONDecodeError):
+        return None
+
+def write_snapshot(name, data, suffix='json'):
+    """Атомарно записываем снапшот, чтобы читатели не увидели файл наполовину"""
+    path = _snapshot_path(name, suffix)
+    try:
+        # Случайное имя и O_EXCL: заранее подложенная ссылка не перехватит запись
+        fd, tmp_path = tempfile.mkstemp(dir=SNAPSHOT_DIR, prefix=f'ocs_{name}.', suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(orjson.dumps(data))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Failed to write snapshot {name}: {str(e)}")
+
+def drop_snapshot(name):
+    for suffix in ('json', 'failed'):
+        try:
+            os.remove(_snapshot_path(name, suffix))
+        except OSError:
+            pass
+
+@contextmanager
+def snapshot_lock(name, timeout=None):
+    """Межпроцессная блокировка: в OCS за снапшотом ходит только один воркер.
+
+    Отдаёт True, если блокировку взяли (или она недоступна на этой платформе),
+    и False, если за timeout (по умолчанию SNAPSHOT_LOCK_TIMEOUT) секунд её так
+    и не отпустили.
+    """
+    if timeout is None:
+        timeout = SNAPSHOT_LOCK_TIMEOUT
+    if fcntl is None:
+        yield True
+        return
+    try:
+        lock_fd = os.open(_snapshot_path(name, 'lock'), os.O_WRONLY | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    except OSError as e:
+        logger.warning(f"Snapshot lock unavailable for {name}: {str(e)}")
+        yield True
+        return
+    try:
+        # Ждём без блокирующего flock: под gevent он остановил бы весь воркер
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    logger.warning(f"Timed out after {timeout}s waiting for snapshot lock {name}")
+                    yield False
+                    return
+                time.sleep(0.1)
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+    finally:
+        os.close(lock_fd)
+
+def _build_fallback_categories():
+    """Статичный список категорий на случай, когда дерево из OCS недоступно"""
+    main_categories = [
+        {'category': f'V{i:02d}', 'name': f'Категория {i}'} 
+        for i in range(1, min(MAX_CATEGORIES + 1, 101))
+    ]
+    # Добавляем реальные основные категории
+    real_cats = [
+        {'category': 'V01', 'name': 'Apple'},
+        {'category': 'V02', 'name': 'Ноутбуки'},
+        {'category': 'V03', 'name': 'Компьютеры'},
+        {'category': 'V04', 'name': 'Мониторы'},
+        {'category': 'V05', 'name': 'Комплектующие'},
+        {'category': 'V06', 'name': 'Периферия'},
+        {'category': 'V07', 'name': 'Сетевое оборудование'},
+        {'category': 'V08', 'name': 'Серверы'},
+        {'category': 'V09', 'name': 'Офисная техника'},
+        {'category': 'V10', 'name': 'Программное обеспечение'},
+        {'category': 'V11', 'name': 'Гаджеты'},
+        {'category': 'V12', 'name': 'Телефоны'},
+        {'category': 'V13', 'name': 'ИБП'},
+        {'category': 'V70', 'name': 'Электронные компоненты'}
+    ]
+    # Объединяем и убираем дубликаты
+    seen = set()
+    main_categories = [c for c in real_cats + main_categories 
+                       if not (c['category'] in seen or seen.add(c['category']))]
+    return {'categories': main_categories[:MAX_CATEGORIES]}
+
+# Заглушка не зависит от запроса: собираем один раз при импорте
+FALLBACK_CATEGORIES_LIGHT = _build_fallback_categories()
+
+# Один SSLContext на процесс: CA-бандл certifi разбирается один раз, а не при
+# каждом новом соединении пула
+SSL_CONTEXT = create_urllib3_context()
+SSL_CONTEXT.load_verify_locations(DEFAULT_CA_BUNDLE_PATH)
+
+# TCP keepalive на соединениях пула: простаивающее между всплесками соединение
+# не обрывается молча NAT'ом или балансировщиком, и первый запрос после паузы
+# не упирается в мёртвый сокет. TCP_NODELAY urllib3 ставит и так.
+SOCKET_OPTIONS = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+if hasattr(socket, 'TCP_KEEPIDLE'):  # Linux; на macOS/Windows — системные интервалы
+    SOCKET_OPTIONS += [
+        (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60),
+        (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 30),
+    ]
+
+class OCSHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter, который отдаёт пулу соединений общий SSL_CONTEXT и опции сокета"""
+    
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = SSL_CONTEXT
+        kwargs['socket_options'] = SOCKET_OPTIONS
+        return super().init_poolmanager(*args, **kwargs)
+    
+    def cert_verify(self, conn, url, verify, cert):
+        super().cert_verify(conn, url, verify, cert)
+        if verify is True:
+            # CA уже в SSL_CONTEXT — иначе urllib3 перечитает бандл на новом соединении
+            conn.ca_certs = None
+            conn.ca_cert_dir = None
+
 class OCSClient:
     def __init__(self):
         self.session = requests.Session()
+        # Стандартный пул (10 соединений) мал для параллельных потоков: лишние
+        # соединения закрываются и каждый раз заново проходят TLS-рукопожатие.
+        # Ретраи — только в _make_request_with_retry: адаптер сам не повторяет,
+        # а read=False отдаёт таймаут чтения как Timeout, а не ConnectionError.
+        adapter = OCSHTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=HTTP_POOL_MAXSIZE,
+            max_retries=Retry(total=0, read=False)
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # Запросы в OCS, которые уже выполняются: cache_key -> Future
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        # Время последних сбоев: deque сам отбрасывает те, что старше порога.
+        # Сбои и удачные ответы приходят из разных потоков — правим под блокировкой
+        self._failure_times = deque(maxlen=CIRCUIT_FAILURE_THRESHOLD)
+        self._circuit_lock = threading.Lock()
+        self._circuit_open_until = 0.0
         if API_KEY:
             self.session.headers.update({
                 'accept': 'application/json',
@@ -65,17 +507,33 @@ class OCSClient:
             })
     
     def _make_request_with_retry(self, method, endpoint, params=None, data=None, 
-                               max_retries=2, timeout=(5, 15)):
-        """Запрос с ретраями для проблемных категорий"""
+                               max_retries=2, timeout=(CONNECT_TIMEOUT, 15), raw=False,
+                               count_timeouts=True):
+        """Запрос с ретраями для проблемных категорий.
+
+        Повторяются только временные сбои (таймаут, обрыв соединения, 5xx), а также
+        408/429 — после паузы из Retry-After. Остальные ошибки (4xx, битый JSON)
+        возвращаются сразу, без ретраев.
+        С raw=True удачный ответ возвращается как есть, байтами, без разбора JSON.
+        С count_timeouts=False запрос, упавший по таймауту чтения, не учитывается
+        circuit breaker'ом: медленный ответ одной категории не значит, что OCS лежит.
+        """
+        if time.time() < self._circuit_open_until:
+            return {'error': 'OCS temporarily unavailable'}, 0, False
+        
+        url = f"{BASE_URL}{endpoint}"
+        last_error = 'Max retries exceeded'
+        retry_after = None
+        read_timeout = False
+        
         for attempt in range(max_retries + 1):
+            if attempt > 0:
+                wait_time = 0.5 * attempt if retry_after is None else retry_after
+                retry_after = None
+                logger.info(f"Retry {attempt} for {endpoint}, waiting {wait_time}s")
+                time.sleep(wait_time)
+            
             try:
-                url = f"{BASE_URL}{endpoint}"
-                
-                if attempt > 0:
-                    wait_time = 0.5 * attempt
-                    logger.info(f"Retry {attempt} for {endpoint}, waiting {wait_time}s")
-                    time.sleep(wait_time)
-                
                 start_time = time.time()
                 
                 response = self.session.request(
@@ -87,95 +545,243 @@ class OCSClient:
                 )
                 
                 elapsed = time.time() - start_time
-                
-                if response.status_code == 200:
-                    logger.info(f"Success: {endpoint} in {elapsed:.2f}s")
-                    return response.json(), elapsed, True
-                else:
-                    logger.warning(f"HTTP {response.status_code} for {endpoint}")
                     
-            except requests.exceptions.Timeout:
+            except requests.exceptions.Timeout as e:
                 logger.warning(f"Timeout attempt {attempt + 1} for {endpoint}")
-                if attempt == max_retries:
-                    return {'error': 'Request timeout after retries'}, 0, False
+                last_error = 'Request timeout after retries'
+                # ConnectTimeout — тоже Timeout, но это недоступность OCS, а не медленный ответ
+                read_timeout = isinstance(e, requests.exceptions.ReadTimeout)
+                continue
                     
             except requests.exceptions.ConnectionError as e:
                 logger.warning(f"Connection error attempt {attempt + 1}: {str(e)}")
-                if attempt == max_retries:
-                    return {'error': f'Connection failed: {str(e)}'}, 0, False
+                last_error = f'Connection failed: {str(e)}'
+                read_timeout = False
+                continue
                     
-            except Exception as e:
-                logger.error(f"Error on attempt {attempt + 1}: {str(e)}")
-                if attempt == max_retries:
-                    return {'error': str(e)}, 0, False
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Request error for {endpoint}: {str(e)}")
+                return {'error': str(e)}, 0, False
+            
+            if response.status_code == 200:
+                if self._failure_times:
+                    with self._circuit_lock:
+                        self._failure_times.clear()
+                if raw:
+                    if 'json' not in response.headers.get('Content-Type', ''):
+                        logger.error(f"Non-JSON response from {endpoint}")
+                        return {'error': 'Invalid JSON in upstream response'}, elapsed, False
+                    logger.debug("Success: %s in %.2fs", endpoint, elapsed)
+                    return response.content, elapsed, True
+                try:
+                    # orjson вместо response.json(): C-парсер по байтам, без угадывания кодировки
+                    result = orjson.loads(response.content)
+                except orjson.JSONDecodeError:
+                    logger.error(f"Invalid JSON from {endpoint}")
+                    return {'error': 'Invalid JSON in upstream response'}, elapsed, False
+                logger.debug("Success: %s in %.2fs", endpoint, elapsed)
+                return result, elapsed, True
+            
+            if response.status_code in TRANSIENT_STATUS_CODES:
+                logger.warning(f"HTTP {response.status_code} for {endpoint}, attempt {attempt + 1}")
+                last_error = f'Upstream HTTP {response.status_code}'
+                read_timeout = False
+                continue
+            
+            if response.status_code in THROTTLE_STATUS_CODES:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if retry_after is None or retry_after <= MAX_RETRY_AFTER:
+                    logger.warning(f"HTTP {response.status_code} for {endpoint}, attempt {attempt + 1}")
+                    last_error = f'Upstream HTTP {response.status_code}'
+                    read_timeout = False
+                    continue
+            
+            logger.warning(f"HTTP {response.status_code} for {endpoint}")
+            return {
+                'error': f'Upstream HTTP {response.status_code}',
+                'status_code': response.status_code
+            }, elapsed, False
         
-        return {'error': 'Max retries exceeded'}, 0, False
+        if count_timeouts or not read_timeout:
+            self._record_failure()
+        return {'error': last_error}, 0, False
+    
+    def _record_failure(self):
+        """Учитываем запрос, исчерпавший ретраи; при серии таких за окно размыкаем цепь"""
+        # Сбои сбрасывает только удачный ответ: после паузы первый же сбой снова размыкает цепь,
+        # если предыдущие ещё в окне
+        now = time.time()
+        with self._circuit_lock:
+            failures = self._failure_times
+            failures.append(now)
+            span = now - failures[0]
+            if len(failures) < CIRCUIT_FAILURE_THRESHOLD or span > CIRCUIT_WINDOW_SECONDS:
+                return
+            self._circuit_open_until = now + CIRCUIT_OPEN_SECONDS
+        logger.warning(f"OCS failed {CIRCUIT_FAILURE_THRESHOLD} times in {span:.0f}s, "
+                       f"pausing upstream calls for {CIRCUIT_OPEN_SECONDS}s")
+    
+    def _single_flight(self, key, fetch, kind=None):
+        """Один запрос в OCS на ключ: параллельные промахи кэша ждут его результат.
+
+        Ожидающие ждут не дольше SINGLE_FLIGHT_TIMEOUT и затем отвечают устаревшим
+        кэшем или ошибкой. С kind владелец сначала ещё раз смотрит в кэш: запрос,
+        завершившийся сразу после нашего промаха, не повторяем.
+        """
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._inflight[key] = future
+        
+        if not is_owner:
+            logger.debug("Waiting for in-flight request %s", key)
+            try:
+                return future.result(timeout=SINGLE_FLIGHT_TIMEOUT)
+            except FutureTimeoutError:
+                return self._fallback(
+                    key, {'error': f'Upstream request still in progress after {SINGLE_FLIGHT_TIMEOUT}s'}
+                )
+        
+        try:
+            data = cache_get(key, kind) if kind is not None else None
+            result = (data, False) if data is not None else fetch()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+    
+    def _fallback(self, cache_key, error):
+        """Ответ при ошибке OCS: последние удачные данные или ошибка, запомненная ненадолго.
+
+        Как и все загрузчики клиента, возвращает (данные, stale): stale=True —
+        отдаём устаревший кэш вместо ответа OCS.
+        """
+        # Ошибку запоминаем и при наличии устаревших данных: иначе каждый запрос
+        # в аварию снова проходит весь цикл ретраев
+        negative_cache_set(cache_key, error)
+        stale = cache_get_stale(cache_key)
+        if stale is not None:
+            # WARNING — один раз на сбой; пока ошибка помнится, _recent_failure пишет в debug
+            logger.warning(f"Upstream failed, serving stale cache for {cache_key}")
+            return stale, True
+        return error, False
+    
+    def _recent_failure(self, cache_key):
+        """Пока ошибка OCS по ключу свежа — (устаревшие данные или ошибка, stale), иначе None"""
+        failed = negative_cache_get(cache_key)
+        if failed is None:
+            return None
+        stale = cache_get_stale(cache_key)
+        if stale is not None:
+            logger.debug("Recent upstream failure, serving stale cache for %s", cache_key)
+            return stale, True
+        return failed, False
+    
+    def _fetch_and_cache(self, cache_key, endpoint, params=None, timeout=(CONNECT_TIMEOUT, 15), raw=False):
+        """GET в OCS с записью удачного ответа в кэш"""
+        failed = self._recent_failure(cache_key)
+        if failed is not None:
+            return failed
+        
+        result, elapsed, success = self._make_request_with_retry(
+            'GET', endpoint,
+            params=params,
+            timeout=timeout,
+            raw=raw
+        )
+        
+        if success:
+            cache_set(cache_key, result)
+            return result, False
+        
+        return self._fallback(cache_key, result)
     
     def get_categories_tree(self, max_retries=1):
-        """Дерево категорий с ретраями"""
+        """Дерево категорий с ретраями: (данные, stale)"""
         cache_key = 'categories_tree'
         
-        if cache_key in cache:
-            data, timestamp = cache[cache_key]
-            if datetime.now().timestamp() - timestamp < CACHE_TTL:
-                logger.info(f"Cache hit for categories tree")
-                return data
+        data = cache_get(cache_key, 'categories_tree')
+        if data is not None:
+            logger.debug("Cache hit for categories tree")
+            return data, False
+        
+        return self._single_flight(
+            cache_key, lambda: self._load_categories_tree(cache_key, max_retries), 'categories_tree'
+        )
+    
+    def _load_categories_tree(self, cache_key, max_retries):
+        """Дерево из общего снапшота воркеров или, если он устарел, из OCS"""
+        # Дерево общее для всех воркеров gunicorn: сначала смотрим снапшот на диске
+        ttl = CACHE_TTLS['categories_tree']
+        snapshot = read_snapshot(cache_key, ttl)
+        if snapshot is None:
+            with snapshot_lock(cache_key) as locked:
+                # Пока ждали блокировку, дерево мог обновить другой воркер
+                snapshot = read_snapshot(cache_key, ttl)
+                if snapshot is None:
+                    # ...или получить ошибку OCS: тогда не повторяем его запрос по очереди
+                    failed = read_snapshot(cache_key, NEGATIVE_CACHE_TTL, 'failed')
+                    if failed is not None:
+                        return self._fallback(cache_key, failed[0])
+                    if not locked:
+                        return self._fallback(cache_key, {'error': 'Categories tree is still loading'})
+                    return self._fetch_categories_tree(cache_key, max_retries)
+        
+        data, timestamp = snapshot
+        logger.debug("Shared snapshot hit for categories tree")
+        cache_set(cache_key, data, timestamp)
+        return data, False
+    
+    def _fetch_categories_tree(self, cache_key, max_retries):
+        """Запрос дерева категорий в OCS с записью в кэш и общий снапшот"""
+        failed = self._recent_failure(cache_key)
+        if failed is not None:
+            return failed
         
         # ⭐ Увеличен таймаут для большого дерева категорий
         result, elapsed, success = self._make_request_with_retry(
             'GET', '/catalog/categories',
             max_retries=max_retries,
-            timeout=(10, 60)  # Было: (5, 20)
+            timeout=(CONNECT_TIMEOUT, 60)  # Было: (5, 20)
         )
         
         log_statistics('categories_tree', success, elapsed)
         
         if success:
-            cache[cache_key] = (result, datetime.now().timestamp())
+            cache_set(cache_key, result)
+            write_snapshot(cache_key, result)
+            return result, False
         
-        return result
+        # Метка ошибки для воркеров, ждущих блокировку: NEGATIVE_CACHE_TTL они не ходят в OCS
+        write_snapshot(cache_key, result, 'failed')
+        return self._fallback(cache_key, result)
     
     def get_categories_light(self):
-        """Легкая версия - основные категории (до 405)"""
+        """Легкая версия - основные категории (до 405): (данные, stale)"""
         cache_key = 'categories_light'
         
-        if cache_key in cache:
-            data, timestamp = cache[cache_key]
-            if datetime.now().timestamp() - timestamp < CACHE_TTL:
-                return data
+        data = cache_get(cache_key, 'categories_light')
+        if data is not None:
+            return data, False
         
-        tree = self.get_categories_tree()
+        tree, tree_stale = self.get_categories_tree()
         
         if 'error' in tree:
-            # Fallback: расширенный статичный список
-            main_categories = [
-                {'category': f'V{i:02d}', 'name': f'Категория {i}'} 
-                for i in range(1, min(MAX_CATEGORIES + 1, 101))
-            ]
-            # Добавляем реальные основные категории
-            real_cats = [
-                {'category': 'V01', 'name': 'Apple'},
-                {'category': 'V02', 'name': 'Ноутбуки'},
-                {'category': 'V03', 'name': 'Компьютеры'},
-                {'category': 'V04', 'name': 'Мониторы'},
-                {'category': 'V05', 'name': 'Комплектующие'},
-                {'category': 'V06', 'name': 'Периферия'},
-                {'category': 'V07', 'name': 'Сетевое оборудование'},
-                {'category': 'V08', 'name': 'Серверы'},
-                {'category': 'V09', 'name': 'Офисная техника'},
-                {'category': 'V10', 'name': 'Программное обеспечение'},
-                {'category': 'V11', 'name': 'Гаджеты'},
-                {'category': 'V12', 'name': 'Телефоны'},
-                {'category': 'V13', 'name': 'ИБП'},
-                {'category': 'V70', 'name': 'Электронные компоненты'}
-            ]
-            # Объединяем и убираем дубликаты
-            seen = set()
-            main_categories = [c for c in real_cats + main_categories 
-                             if not (c['category'] in seen or seen.add(c['category']))]
-            result = {'categories': main_categories[:MAX_CATEGORIES]}
-            cache[cache_key] = (result, datetime.now().timestamp())
-            return result
+            # Не затираем последний удачный список заглушкой — отдаём его, даже если TTL истёк
+            stale = cache_get_stale(cache_key)
+            if stale is not None:
+                logger.debug("Categories tree unavailable, serving stale %s", cache_key)
+                return stale, True
+            
+            # Заглушку не кэшируем: при следующем запросе снова пробуем OCS.
+            # Для клиента это тоже не свежие данные
+            return FALLBACK_CATEGORIES_LIGHT, True
         
         def extract_main_categories(category_tree, level=0):
             main_cats = []
@@ -197,38 +803,51 @@ class OCSClient:
         # ⭐ УВЕЛИЧЕНО: возвращаем до 405 категорий (было 20)
         result = {'categories': main_cats[:MAX_CATEGORIES]}
         
-        cache[cache_key] = (result, datetime.now().timestamp())
-        logger.info(f"Returning {len(result['categories'])} categories (max: {MAX_CATEGORIES})")
-        return result
+        # Список из устаревшего дерева не кэшируем как свежий
+        if not tree_stale:
+            cache_set(cache_key, result)
+        logger.debug("Returning %d categories (max: %d)", len(result['categories']), MAX_CATEGORIES)
+        return result, tree_stale
     
-    def get_products_by_category(self, category, shipmentcity, **params):
-        """Товары по категории — до 5000 товаров"""
+    def get_products_by_category(self, category, shipmentcity, use_cache=True, **params):
+        """Товары по категории — до 5000 товаров: (данные, stale).
+
+        use_cache=False не читает кэш (свежий ответ OCS), но результат в него записывает.
+        """
         cache_key = f"products_{category}_{shipmentcity}_{str(sorted(params.items()))}"
         
-        if cache_key in cache:
-            data, timestamp = cache[cache_key]
-            if datetime.now().timestamp() - timestamp < CACHE_TTL:
-                logger.info(f"Cache hit for category {category}")
-                return data
+        data = cache_get(cache_key, 'products') if use_cache else None
+        if data is not None:
+            logger.debug("Cache hit for category %s", category)
+            return data, False
+        
+        return self._single_flight(
+            cache_key, lambda: self._fetch_products(category, shipmentcity, cache_key, params),
+            'products' if use_cache else None
+        )
+    
+    def _fetch_products(self, category, shipmentcity, cache_key, params):
+        """Запрос товаров категории в OCS с обрезкой до лимита и записью в кэш"""
+        failed = self._recent_failure(cache_key)
+        if failed is not None:
+            return failed
         
         # ⭐ Проблемные категории: больше ретраев и таймаут
-        is_heavy = category in ['V08', 'V09', 'V02', 'V05']
+        is_heavy = category in HEAVY_CATEGORIES
         max_retries = 3 if is_heavy else 2
-        timeout = (15, 90) if is_heavy else (10, 45)  # ⭐ Увеличено для 5000 товаров
+        timeout = (CONNECT_TIMEOUT, 90 if is_heavy else 45)  # ⭐ Увеличено для 5000 товаров
         
         endpoint = f"/catalog/categories/{category}/products"
-        query_params = {'shipmentcity': shipmentcity}
-        query_params.update(params)
-        
         # Оптимизация: по умолчанию без описаний
-        if 'withdescriptions' not in query_params:
-            query_params['withdescriptions'] = 'false'
+        query_params = {'shipmentcity': shipmentcity, 'withdescriptions': 'false', **params}
         
         result, elapsed, success = self._make_request_with_retry(
             'GET', endpoint,
             params=query_params,
             max_retries=max_retries,
-            timeout=timeout
+            timeout=timeout,
+            # Тяжёлые категории читаются минутами — их таймауты не размыкают цепь для всех
+            count_timeouts=not is_heavy
         )
         
         log_statistics(category, success, elapsed)
@@ -236,7 +855,7 @@ class OCSClient:
         if success and isinstance(result, dict):
             if 'result' in result and isinstance(result['result'], list):
                 total_products = len(result['result'])
-                logger.info(f"Category {category}: received {total_products} products")
+                logger.debug("Category %s: received %d products", category, total_products)
                 
                 # ⭐ УВЕЛИЧЕНО: лимит до 5000 товаров (было 100)
                 if total_products > MAX_PRODUCTS_PER_REQUEST:
@@ -245,19 +864,23 @@ class OCSClient:
                     result['suggestion'] = 'Use pagination endpoint for full access'
                     logger.warning(f"Category {category} limited to {MAX_PRODUCTS_PER_REQUEST} products")
                 
-                cache[cache_key] = (result, datetime.now().timestamp())
+                cache_set(cache_key, result)
+                return result, False
+        
+        if not success:
+            return self._fallback(cache_key, result)
         
-        return result
+        return result, False
     
     def get_products_paginated(self, category, shipmentcity, page=1, per_page=100, **params):
-        """Пагинация товаров — до 500 на страницу для производительности"""
-        all_products = self.get_products_by_category(category, shipmentcity, **params)
+        """Пагинация товаров — до 500 на страницу для производительности: (данные, stale)"""
+        all_products, stale = self.get_products_by_category(category, shipmentcity, **params)
         
         if 'error' in all_products:
-            return all_products
+            return all_products, stale
         
         if 'result' not in all_products or not isinstance(all_products['result'], list):
-            return {'error': 'Invalid response format', 'data': all_products}
+            return {'error': 'Invalid response format', 'data': all_products}, stale
         
         products = all_products['result']
         total = len(products)
@@ -279,7 +902,7 @@ class OCSClient:
                     'has_next': False,
                     'has_prev': page > 1
                 }
-            }
+            }, stale
         
         paginated_products = products[start_idx:end_idx]
         
@@ -295,69 +918,51 @@ class OCSClient:
             },
             'category': category,
             'shipmentcity': shipmentcity
-        }
+        }, stale
     
     def get_product_info(self, item_id, shipmentcity, **params):
-        """Информация по товару"""
-        cache_key = f"product_{item_id}_{shipmentcity}"
+        """Информация по товару.
+
+        Ответ OCS не разбираем: удачный результат — исходные байты JSON,
+        ошибка — dict с ключом 'error'. Возвращает (данные, stale).
+        """
+        cache_key = f"product_{item_id}_{shipmentcity}_{str(sorted(params.items()))}"
         
-        if cache_key in cache:
-            data, timestamp = cache[cache_key]
-            if datetime.now().timestamp() - timestamp < CACHE_TTL:
-                return data
+        data = cache_get(cache_key, 'product')
+        if data is not None:
+            return data, False
         
         endpoint = f"/catalog/products/{item_id}"
-        query_params = {'shipmentcity': shipmentcity}
-        query_params.update(params)
+        query_params = {'shipmentcity': shipmentcity, **params}
         
-        result, elapsed, success = self._make_request_with_retry(
-            'GET', endpoint,
-            params=query_params,
-            timeout=(3, 15)
+        return self._single_flight(
+            cache_key, lambda: self._fetch_and_cache(cache_key, endpoint, query_params, raw=True), 'product'
         )
-        
-        if success:
-            cache[cache_key] = (result, datetime.now().timestamp())
-        
-        return result
     
     def get_shipment_cities(self):
-        """Города отгрузки"""
+        """Города отгрузки: (данные, stale)"""
         cache_key = 'shipment_cities'
         
-        if cache_key in cache:
-            data, timestamp = cache[cache_key]
-            if datetime.now().timestamp() - timestamp < CACHE_TTL:
-                return data
+        data = cache_get(cache_key, 'shipment_cities')
+        if data is not None:
+            return data, False
         
-        result, elapsed, success = self._make_request_with_retry(
-            'GET', '/logistic/shipment/cities',
-            timeout=(3, 15)
+        return self._single_flight(
+            cache_key, lambda: self._fetch_and_cache(cache_key, '/logistic/shipment/cities'), 'shipment_cities'
         )
-        
-        if success:
-            cache[cache_key] = (result, datetime.now().timestamp())
-        
-        return result
     
     def get_currency_exchanges(self):
-        """Курсы валют"""
+        """Курсы валют: (данные, stale)"""
         cache_key = 'currency_exchanges'
         
-        if cache_key in cache:
-            data, timestamp = cache[cache_key]
-            if datetime.now().timestamp() - timestamp < 300:
-                return data
+        data = cache_get(cache_key, 'currency_exchanges')
+        if data is not None:
+            return data, False
         
-        result, elapsed, success = self._make_request_with_retry(
-            'GET', '/account/currencies/exchanges',
-            timeout=(3, 15)
+        return self._single_flight(
+            cache_key, lambda: self._fetch_and_cache(cache_key, '/account/currencies/exchanges'),
+            'currency_exchanges'
         )
-        
-        if success:
-            cache[cache_key] = (result, datetime.now().timestamp() + 300)
-        
-        return result
     
     def get_category_stats(self):
         """Статистика по категориям"""
@@ -372,71 +977,253 @@ class OCSClient:
 
 client = OCSClient()
 
+# Refresh-ahead: справочники, которые уже запрашивали, обновляем в фоне до истечения
+# TTL, чтобы ручки не ждали OCS на промахе кэша. 0 — выключить.
+REFRESH_INTERVAL = int(os.getenv('OCS_REFRESH_INTERVAL', 20))
+REFRESH_AHEAD_ENDPOINTS = {
+    'shipment_cities': '/logistic/shipment/cities',
+    'currency_exchanges': '/account/currencies/exchanges',
+}
+_refresher_started = False
+_refresher_lock = threading.Lock()
+
+def _refresh_cache_once():
+    """Один проход refresh-ahead по справочникам, которые читали после прошлого обновления"""
+    for cache_key, endpoint in REFRESH_AHEAD_ENDPOINTS.items():
+        entry = cache.get(cache_key)
+        if entry is None:
+            continue
+        # Без чтений с момента записи запись не обновляем: иначе каждый воркер
+        # вечно ходил бы в OCS за ключом, который однажды запросили
+        if cache_hits.get(cache_key, 0) <= entry[1]:
+            continue
+        # Обновляем с запасом в два интервала, пока запись ещё свежая
+        if time.time() - entry[1] < CACHE_TTLS[cache_key] - 2 * REFRESH_INTERVAL:
+            continue
+        try:
+            client._single_flight(
+                cache_key, lambda: client._fetch_and_cache(cache_key, endpoint)
+            )
+        except Exception as e:
+            logger.warning(f"Background refresh failed for {cache_key}: {str(e)}")
+
+def _refresh_cache_loop():
+    while True:
+        time.sleep(REFRESH_INTERVAL)
+        _refresh_cache_once()
+
+def start_cache_refresher():
+    """Запускает фоновое обновление кэша один раз на процесс"""
+    global _refresher_started
+    if REFRESH_INTERVAL <= 0:
+        return
+    with _refresher_lock:
+        if _refresher_started:
+            return
+        threading.Thread(target=_refresh_cache_loop, name='ocs-refresh', daemon=True).start()
+        _refresher_started = True
+
+start_cache_refresher()
+
+def _warm_up():
+    """DNS, TCP и TLS до OCS поднимаем при старте воркера, а не на первом запросе клиента"""
+    for load in (client.get_shipment_cities, client.get_currency_exchanges):
+        try:
+            load()
+        except Exception as e:
+            logger.warning(f"Warm-up request failed: {str(e)}")
+
+if API_KEY and os.getenv('OCS_WARMUP', 'true').lower() == 'true':
+    threading.Thread(target=_warm_up, name='ocs-warmup', daemon=True).start()
+
+# Пул для параллельных запросов к OCS внутри одной ручки (общий на процесс)
+executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='ocs')
+
+# Health-check отвечает не дольше этого, даже если OCS тормозит: запрос к OCS
+# при этом доходит в пуле до конца и заполняет кэш
+HEALTH_CHECK_TIMEOUT = 10
+
+# /api/bootstrap ждёт секции не дольше этого: не дождавшиеся приходят ошибкой,
+# остальные отдаются как есть
+BOOTSTRAP_TIMEOUT = 20
+
+# Метка времени ответов: одна строка на процесс, обновляется не чаще раза в секунду
+_now_iso = datetime.now().isoformat()
+_now_ts = time.monotonic()
+
+def now_iso():
+    """Метка времени ответа с точностью до секунды без datetime на каждый запрос"""
+    global _now_iso, _now_ts
+    t = time.monotonic()
+    if t - _now_ts > 1.0:
+        _now_iso = datetime.now().isoformat()
+        _now_ts = t
+    return _now_iso
+
+def json_response(body, status=200):
+    """Ответ из уже сериализованного JSON (bytes) — без повторного прохода через jsonify"""
+    return app.response_class(body, status=status, mimetype='application/json')
+
+def body_etag(body):
+    return hashlib.blake2b(body, digest_size=8).hexdigest()
+
+def mark_stale(response):
+    """Ответ из устаревшего кэша (OCS недоступен): помечаем и не даём его кэшировать"""
+    response.headers['X-Cache'] = 'STALE'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# Сериализованные тела справочников: cache_key -> (данные, bytes, ETag)
+serialized_bodies = {}
+
+# Браузер и CDN держат справочники не дольше самого короткого TTL кэша (курсы — 5 минут)
+REFERENCE_CACHE_CONTROL = 'public, max-age=300, stale-while-revalidate=60'
+
+def cached_json_response(cache_key, data, stale=False):
+    """Ответ для данных из кэша: сериализуем и хэшируем один раз, пока в кэше тот же объект"""
+    entry = serialized_bodies.get(cache_key)
+    if entry is None or entry[0] is not data:
+        body = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        entry = (data, body, body_etag(body))
+        serialized_bodies[cache_key] = entry
+    response = json_response(entry[1])
+    response.set_etag(entry[2])
+    if stale:
+        return mark_stale(response)
+    # Кэшировать клиентам можно только то, что лежит в нашем кэше: ошибка OCS
+    # и статичная заглушка категорий туда не попадают
+    cached = cache.get(cache_key)
+    if cached is not None and cached[0] is data:
+        response.headers['Cache-Control'] = REFERENCE_CACHE_CONTROL
+    return response
+
+# Сериализованные списки товаров: ключ запроса -> (данные, bytes, ETag). Тело на 5000
+# товаров весит мегабайты, поэтому держим немного и при переполнении начинаем заново.
+# ETag нужен compress_response, чтобы не сжимать одно и то же тело на каждом запросе
+product_bodies = {}
+PRODUCT_BODIES_MAX = 32
+
+def products_json_response(key, data, stale=False):
+    """Ответ со списком товаров из кэша без повторной сериализации на каждом попадании"""
+    entry = product_bodies.get(key)
+    if entry is None or entry[0] is not data:
+        if len(product_bodies) >= PRODUCT_BODIES_MAX:
+            product_bodies.clear()
+        body = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        entry = (data, body, body_etag(body))
+        product_bodies[key] = entry
+    response = json_response(entry[1])
+    response.set_etag(entry[2])
+    return mark_stale(response) if stale else response
+
+SHIPMENTCITY_REQUIRED_BODY = orjson.dumps({'error': 'Parameter shipmentcity is required'})
+INVALID_PAGINATION_BODY = orjson.dumps({'error': 'page and per_page must be positive integers'})
+
+def shipmentcity_required(view):
+    """Проверяет обязательный ?shipmentcity= и передаёт его в ручку аргументом"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        shipmentcity = request.args.get('shipmentcity')
+        if not shipmentcity:
+            return json_response(SHIPMENTCITY_REQUIRED_BODY, 400)
+        return view(*args, shipmentcity=shipmentcity, **kwargs)
+    return wrapper
+
+# Ручки, которые ходят в OCS: без ключа их запросы заведомо получат 401
+UPSTREAM_ENDPOINTS = frozenset({
+    'get_cities', 'get_categories', 'get_categories_light', 'get_category_products',
+    'get_category_products_paginated', 'get_product_info', 'get_currency',
+    'health', 'test_category', 'bootstrap'
+})
+NO_API_KEY_BODY = orjson.dumps({'error': 'OCS_API_KEY is not configured'})
+
+if not API_KEY:
+    logger.warning("OCS_API_KEY is not set: upstream endpoints will return 500")
+    
+    @app.before_request
+    def require_api_key():
+        """Ключ задаётся при старте: проверка нужна только если его нет"""
+        if request.endpoint in UPSTREAM_ENDPOINTS:
+            return json_response(NO_API_KEY_BODY, 500)
+
+# Справочники меняются редко: клиент с актуальной копией получает 304 без тела
+ETAG_ENDPOINTS = frozenset({'get_cities', 'get_categories', 'get_categories_light', 'get_currency'})
+
+@app.after_request
+def add_etag(response):
+    if request.endpoint in ETAG_ENDPOINTS and response.status_code == 200:
+        # cached_json_response уже проставил ETag из кэша — тело повторно не хэшируем
+        if response.get_etag()[0] is None:
+            response.set_etag(body_etag(response.get_data()))
+        return response.make_conditional(request)
+    return response
+
 # ============ РУЧКИ API ============
 
+# Описание сервиса статично: сериализуем один раз при импорте
+HOME_BODY = orjson.dumps({
+    'service': 'OCS API Proxy',
+    'status': 'operational',
+    'version': '2.1-large-limits',
+    'limits': {
+        'max_categories': MAX_CATEGORIES,
+        'max_products_per_request': MAX_PRODUCTS_PER_REQUEST,
+        'max_pagination_per_page': MAX_PAGINATION_PER_PAGE
+    },
+    'features': [
+        '✅ Support for up to 405 categories',
+        '✅ Up to 5000 products per category request',
+        '✅ Retry mechanism for failed requests',
+        '✅ Smart caching (per-endpoint TTL, 5-60 minutes)',
+        '✅ Pagination support',
+        '✅ Category statistics',
+        '✅ Optimized timeouts for large responses'
+    ],
+    'endpoints': {
+        'cities': '/api/cities',
+        'categories': '/api/categories',
+        'categories_light': '/api/categories/light',
+        'products': '/api/categories/<category>/products?shipmentcity=...',
+        'products_paginated': '/api/categories/<category>/products/page/<int:page>?shipmentcity=...&per_page=...',
+        'product_info': '/api/products/<item_id>?shipmentcity=...',
+        'currency': '/api/currency',
+        'bootstrap': '/api/bootstrap',
+        'stats': '/api/stats',
+        'health': '/api/health'
+    },
+    'tips': [
+        f'Use /api/categories/light for up to {MAX_CATEGORIES} categories',
+        f'Heavy categories (V08, V09, V02) support up to {MAX_PRODUCTS_PER_REQUEST} products',
+        'Add ?withdescriptions=false to speed up product requests',
+        'Use pagination for better performance: ?page=1&per_page=100'
+    ]
+})
+
 @app.route('/')
 def home():
-    return jsonify({
-        'service': 'OCS API Proxy',
-        'status': 'operational',
-        'version': '2.1-large-limits',
-        'limits': {
-            'max_categories': MAX_CATEGORIES,
-            'max_products_per_request': MAX_PRODUCTS_PER_REQUEST,
-            'max_pagination_per_page': MAX_PAGINATION_PER_PAGE
-        },
-        'features': [
-            '✅ Support for up to 405 categories',
-            '✅ Up to 5000 products per category request',
-            '✅ Retry mechanism for failed requests',
-            '✅ Smart caching (5 minutes TTL)',
-            '✅ Pagination support',
-            '✅ Category statistics',
-            '✅ Optimized timeouts for large responses'
-        ],
-        'endpoints': {
-            'cities': '/api/cities',
-            'categories': '/api/categories',
-            'categories_light': '/api/categories/light',
-            'products': '/api/categories/<category>/products?shipmentcity=...',
-            'products_paginated': '/api/categories/<category>/products/page/<int:page>?shipmentcity=...&per_page=...',
-            'product_info': '/api/products/<item_id>?shipmentcity=...',
-            'currency': '/api/currency',
-            'stats': '/api/stats',
-            'health': '/api/health'
-        },
-        'tips': [
-            f'Use /api/categories/light for up to {MAX_CATEGORIES} categories',
-            f'Heavy categories (V08, V09, V02) support up to {MAX_PRODUCTS_PER_REQUEST} products',
-            'Add ?withdescriptions=false to speed up product requests',
-            'Use pagination for better performance: ?page=1&per_page=100'
-        ]
-    })
+    return json_response(HOME_BODY)
 
 @app.route('/api/cities')
 def get_cities():
-    result = client.get_shipment_cities()
-    return jsonify(result)
+    result, stale = client.get_shipment_cities()
+    return cached_json_response('shipment_cities', result, stale)
 
 @app.route('/api/categories')
 def get_categories():
     """Полное дерево категорий"""
-    result = client.get_categories_tree()
-    return jsonify(result)
+    result, stale = client.get_categories_tree()
+    return cached_json_response('categories_tree', result, stale)
 
 @app.route('/api/categories/light')
 def get_categories_light():
     """Основные категории — до 405"""
-    result = client.get_categories_light()
-    return jsonify(result)
+    result, stale = client.get_categories_light()
+    return cached_json_response('categories_light', result, stale)
 
-@app.route('/api/categories/<category>/products')
-def get_category_products(category):
+@app.route('/api/categories/<ocs_id:category>/products')
+@shipmentcity_required
+def get_category_products(category, shipmentcity):
     """Товары по категории — до 5000 товаров"""
-    shipmentcity = request.args.get('shipmentcity')
-    if not shipmentcity:
-        return jsonify({'error': 'Parameter shipmentcity is required'}), 400
-    
     params = {
         'onlyavailable': request.args.get('onlyavailable', 'true'),
         'includeregular': request.args.get('includeregular', 'true'),
@@ -446,29 +1233,26 @@ def get_category_products(category):
         'withdescriptions': request.args.get('withdescriptions', 'false'),
     }
     
-    for param in ['locations', 'producers', 'includesale', 'includeuncondition', 'includemissing']:
-        if param in request.args:
-            params[param] = request.args.get(param)
-    
-    is_heavy = category in ['V08', 'V09', 'V02', 'V05']
-    if is_heavy:
-        params['note'] = f'Heavy category: timeout up to 90s, limit {MAX_PRODUCTS_PER_REQUEST} products'
+    params.update(
+        (param, request.args.getlist(param) if param in MULTI_VALUE_PRODUCT_PARAMS else request.args[param])
+        for param in OPTIONAL_PRODUCT_PARAMS if param in request.args
+    )
     
-    result = client.get_products_by_category(category, shipmentcity, **params)
-    return jsonify(result)
+    result, stale = client.get_products_by_category(category, shipmentcity, **params)
+    return products_json_response(f"{category}_{shipmentcity}_{str(sorted(params.items()))}", result, stale)
 
-@app.route('/api/categories/<category>/products/page/<int:page>')
-def get_category_products_paginated(category, page):
+@app.route('/api/categories/<ocs_id:category>/products/page/<int:page>')
+@shipmentcity_required
+def get_category_products_paginated(category, page, shipmentcity):
     """Товары с пагинацией"""
-    shipmentcity = request.args.get('shipmentcity')
-    if not shipmentcity:
-        return jsonify({'error': 'Parameter shipmentcity is required'}), 400
-    
-    per_page = int(request.args.get('per_page', 100))
+    per_page = request.args.get('per_page', 100, type=int)
+    # Некорректную страницу отклоняем сразу, не запрашивая категорию в OCS
+    if page < 1 or per_page < 1:
+        return json_response(INVALID_PAGINATION_BODY, 400)
     # ⭐ Ограничиваем per_page для стабильности
     if per_page > MAX_PAGINATION_PER_PAGE:
         per_page = MAX_PAGINATION_PER_PAGE
-        logger.warning(f"per_page limited to {MAX_PAGINATION_PER_PAGE} for performance")
+        logger.debug("per_page limited to %d for performance", MAX_PAGINATION_PER_PAGE)
     
     params = {
         'onlyavailable': request.args.get('onlyavailable', 'true'),
@@ -476,28 +1260,55 @@ def get_category_products_paginated(category, page):
         'withdescriptions': request.args.get('withdescriptions', 'false'),
     }
     
-    result = client.get_products_paginated(category, shipmentcity, page, per_page, **params)
-    return jsonify(result)
+    result, stale = client.get_products_paginated(category, shipmentcity, page, per_page, **params)
+    response = jsonify(result)
+    return mark_stale(response) if stale else response
 
-@app.route('/api/products/<item_id>')
-def get_product_info(item_id):
+@app.route('/api/products/<ocs_id:item_id>')
+@shipmentcity_required
+def get_product_info(item_id, shipmentcity):
     """Информация по товару"""
-    shipmentcity = request.args.get('shipmentcity')
-    if not shipmentcity:
-        return jsonify({'error': 'Parameter shipmentcity is required'}), 400
-    
     params = {
         'includeregular': request.args.get('includeregular', 'true'),
         'withdescriptions': request.args.get('withdescriptions', 'true')
     }
     
-    result = client.get_product_info(item_id, shipmentcity, **params)
-    return jsonify(result)
+    result, stale = client.get_product_info(item_id, shipmentcity, **params)
+    if isinstance(result, bytes):
+        # Тело OCS отдаём как есть — без повторного разбора и сериализации
+        response = json_response(result)
+    else:
+        response = jsonify(result)
+    return mark_stale(response) if stale else response
 
 @app.route('/api/currency')
 def get_currency():
-    result = client.get_currency_exchanges()
-    return jsonify(result)
+    result, stale = client.get_currency_exchanges()
+    return cached_json_response('currency_exchanges', result, stale)
+
+@app.route('/api/bootstrap')
+def bootstrap():
+    """Города, основные категории и курсы одним запросом — для стартового экрана клиента"""
+    # Запросы независимы: ждём самый медленный, а не сумму трёх
+    futures = {
+        'cities': executor.submit(client.get_shipment_cities),
+        'categories': executor.submit(client.get_categories_light),
+        'currency': executor.submit(client.get_currency_exchanges),
+    }
+    done, _ = wait(futures.values(), timeout=BOOTSTRAP_TIMEOUT)
+    timed_out = ({'error': f'No response within {BOOTSTRAP_TIMEOUT}s'}, False)
+    
+    payload = {}
+    stale = False
+    for section, future in futures.items():
+        data, section_stale = future.result() if future in done else timed_out
+        payload[section] = data
+        stale = stale or section_stale
+    payload['timestamp'] = now_iso()
+    
+    response = jsonify(payload)
+    # Флаг приходит из потоков пула вместе с данными — без контекста запроса
+    return mark_stale(response) if stale else response
 
 @app.route('/api/stats')
 def get_stats():
@@ -510,22 +1321,33 @@ def get_stats():
     return jsonify({
         'request_statistics': stats,
         'cache_info': cache_info,
-        'timestamp': datetime.now().isoformat()
+        'timestamp': now_iso()
     })
 
 @app.route('/api/health')
 def health():
-    cities = client.get_shipment_cities()
-    currency = client.get_currency_exchanges()
+    # Независимые проверки идут параллельно: время ответа = max, а не сумма
+    cities_future = executor.submit(client.get_shipment_cities)
+    currency_future = executor.submit(client.get_currency_exchanges)
+    done, _ = wait((cities_future, currency_future), timeout=HEALTH_CHECK_TIMEOUT)
+    timed_out = ({'error': f'No response within {HEALTH_CHECK_TIMEOUT}s'}, False)
+    cities, cities_stale = cities_future.result() if cities_future in done else timed_out
+    currency, currency_stale = currency_future.result() if currency_future in done else timed_out
+    
+    def check(result, stale):
+        # Устаревший кэш вместо ответа OCS — тоже сбой upstream, хоть ошибки в теле и нет
+        if 'error' in result:
+            return 'failed'
+        return 'stale' if stale else 'ok'
     
     health_status = 'healthy'
     checks = {
-        'cities_endpoint': 'ok' if 'error' not in cities else 'failed',
-        'currency_endpoint': 'ok' if 'error' not in currency else 'failed',
+        'cities_endpoint': check(cities, cities_stale),
+        'currency_endpoint': check(currency, currency_stale),
         'cache': 'ok' if len(cache) > 0 else 'empty'
     }
     
-    if 'failed' in checks.values():
+    if 'failed' in checks.values() or 'stale' in checks.values():
         health_status = 'degraded'
     
     problematic = [
@@ -536,11 +1358,11 @@ def health():
     total_req = sum(stats.get('total', 0) for stats in request_stats.values())
     total_ok = sum(stats.get('success', 0) for stats in request_stats.values())
     
-    return jsonify({
+    response = jsonify({
         'status': health_status,
         'checks': checks,
         'problematic_categories': problematic[:5],
-        'timestamp': datetime.now().isoformat(),
+        'timestamp': now_iso(),
         'uptime_checks': {
             'total_requests': total_req,
             'success_rate': f"{total_ok / max(1, total_req):.1%}"
@@ -550,47 +1372,63 @@ def health():
             'max_products': MAX_PRODUCTS_PER_REQUEST
         }
     })
+    if cities_stale or currency_stale:
+        mark_stale(response)
+    return response
 
 @app.route('/api/cache/clear')
 def clear_cache():
     cache.clear()
+    cache_hits.clear()
+    failed_requests.clear()
+    serialized_bodies.clear()
+    product_bodies.clear()
+    compressed_bodies.clear()
+    drop_snapshot('categories_tree')
     return jsonify({
         'message': 'Cache cleared',
         'cleared_entries': 0,
-        'timestamp': datetime.now().isoformat()
+        'timestamp': now_iso()
     })
 
+# Советы статичны: сериализуем один раз при импорте
+TIPS_BODY = orjson.dumps({
+    'performance_tips': [
+        f'Use /api/categories/light for up to {MAX_CATEGORIES} categories',
+        f'Heavy categories return up to {MAX_PRODUCTS_PER_REQUEST} products',
+        'Add ?withdescriptions=false for 2-3x faster product requests',
+        'Use pagination for large result sets: ?page=1&per_page=100',
+        'Cache responses client-side for production'
+    ],
+    'timeout_info': {
+        'heavy_categories': 'Up to 90s for V08/V09/V02 with 5000 products',
+        'light_categories': 'Up to 45s for other categories',
+        'pagination': 'Up to 45s per page (500 products)'
+    },
+    'recommended_flow': [
+        '1. GET /api/cities',
+        '2. GET /api/categories/light',
+        '3. GET /api/categories/{code}/products?shipmentcity=...&withdescriptions=false',
+        '4. Use pagination for large categories: /page/1?per_page=100',
+        '5. GET /api/products/{id}?shipmentcity=... for details'
+    ]
+})
+
 @app.route('/api/tips')
 def get_tips():
-    return jsonify({
-        'performance_tips': [
-            f'Use /api/categories/light for up to {MAX_CATEGORIES} categories',
-            f'Heavy categories return up to {MAX_PRODUCTS_PER_REQUEST} products',
-            'Add ?withdescriptions=false for 2-3x faster product requests',
-            'Use pagination for large result sets: ?page=1&per_page=100',
-            'Cache responses client-side for production'
-        ],
-        'timeout_info': {
-            'heavy_categories': 'Up to 90s for V08/V09/V02 with 5000 products',
-            'light_categories': 'Up to 45s for other categories',
-            'pagination': 'Up to 45s per page (500 products)'
-        },
-        'recommended_flow': [
-            '1. GET /api/cities',
-            '2. GET /api/categories/light',
-            '3. GET /api/categories/{code}/products?shipmentcity=...&withdescriptions=false',
-            '4. Use pagination for large categories: /page/1?per_page=100',
-            '5. GET /api/products/{id}?shipmentcity=... for details'
-        ]
-    })
+    return json_response(TIPS_BODY)
 
-@app.route('/api/test/category/<category>')
+@app.route('/api/test/category/<ocs_id:category>')
 def test_category(category):
     """Тестирование конкретной категории"""
     shipmentcity = request.args.get('shipmentcity', 'Краснодар')
+    # ?nocache=1 — замер реального ответа OCS, а не попадания в кэш
+    use_cache = request.args.get('nocache') not in ('1', 'true')
     
     start_time = time.time()
-    result = client.get_products_by_category(category, shipmentcity, withdescriptions='false')
+    result, _ = client.get_products_by_category(
+        category, shipmentcity, use_cache=use_cache, withdescriptions='false'
+    )
     elapsed = time.time() - start_time
     
     response = {
@@ -610,35 +1448,39 @@ def test_category(category):
     
     return jsonify(response)
 
+# Заглушка старых URL не зависит от запроса — тело собираем один раз
+ENDPOINT_MOVED_BODY = orjson.dumps({
+    'error': 'Endpoint moved',
+    'new_location': '/api/...',
+    'documentation': '/'
+})
+
 @app.route('/content/<path:path>')
 @app.route('/catalog/<path:path>')
 @app.route('/logistic/<path:path>')
 def old_urls_redirect(path):
-    return jsonify({
-        'error': 'Endpoint moved',
-        'new_location': '/api/...',
-        'documentation': '/',
-        'timestamp': datetime.now().isoformat()
-    }), 404
+    return json_response(ENDPOINT_MOVED_BODY, 404)
+
+NOT_FOUND_BODY = orjson.dumps({
+    'error': 'Not found',
+    'available_endpoints': [
+        '/api/cities', '/api/categories', '/api/categories/light',
+        '/api/categories/<category>/products', '/api/products/<item_id>',
+        '/api/currency', '/api/stats', '/api/health'
+    ]
+})
 
 @app.errorhandler(404)
 def not_found(e):
-    return jsonify({
-        'error': 'Not found',
-        'available_endpoints': [
-            '/api/cities', '/api/categories', '/api/categories/light',
-            '/api/categories/<category>/products', '/api/products/<item_id>',
-            '/api/currency', '/api/stats', '/api/health'
-        ]
-    }), 404
+    return json_response(NOT_FOUND_BODY, 404)
+
+# Текст исключения клиенту не отдаём — только в лог
+INTERNAL_ERROR_BODY = orjson.dumps({'error': 'Internal server error'})
 
 @app.errorhandler(500)
 def internal_error(e):
-    logger.error(f"Internal error: {str(e)}")
-    return jsonify({
-        'error': 'Internal server error',
-        'timestamp': datetime.now().isoformat()
-    }), 500
+    """Единый JSON-ответ на необработанные исключения; трейсбек уже записал Flask (log_exception)"""
+    return json_response(INTERNAL_ERROR_BODY, 500)
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 10000))
@@ -0,0 +1,16 @@
+import os
+
+# Все ручки ждут ответа OCS: gevent-воркер переключается между запросами на
+# время сетевого ожидания и держит сотни соединений в одном процессе.
+# Воркер сам делает monkey.patch_all() до импорта app, так что requests.Session
+# в OCSClient становится неблокирующим без изменений в коде.
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+worker_class = 'gevent'
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', '500'))
+
+# С gevent таймаут — это heartbeat воркера, а не лимит на запрос:
+# тяжёлые категории (до 90 с на чтение) ему не мешают
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
@@ -0,0 +1,89 @@
+import json
+import os
+import sys
+import tempfile
+
+# Окружение задаём до импорта app: ключ, без прогрева и фонового обновления,
+# снапшоты — во временный каталог теста
+os.environ.setdefault('OCS_API_KEY', 'test-key')
+os.environ['OCS_WARMUP'] = 'false'
+os.environ['OCS_REFRESH_INTERVAL'] = '0'
+os.environ['OCS_SNAPSHOT_DIR'] = tempfile.mkdtemp(prefix='ocs-tests-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import app as app_module
+
+
+class FakeResponse:
+    """Ответ OCS в том объёме, который читает OCSClient"""
+
+    def __init__(self, status_code, payload=None, headers=None):
+        self.status_code = status_code
+        self.content = json.dumps(payload if payload is not None else {}).encode()
+        self.headers = {'Content-Type': 'application/json; charset=utf-8', **(headers or {})}
+
+
+class FakeOCS:
+    """Подмена OCSClient.session.request: ответы по суффиксу пути и журнал вызовов.
+
+    Ответом может быть FakeResponse, функция от kwargs запроса или исключение.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.calls = []
+        self.params = []
+
+    def respond(self, suffix, status_code, payload=None, headers=None):
+        self.routes[suffix] = FakeResponse(status_code, payload, headers)
+
+    def request(self, method=None, url=None, **kwargs):
+        self.calls.append(url)
+        self.params.append(kwargs.get('params'))
+        for suffix, response in self.routes.items():
+            if url.endswith(suffix):
+                if isinstance(response, BaseException):
+                    raise response
+                if callable(response):
+                    return response(url=url, **kwargs)
+                return response
+        return FakeResponse(404)
+
+
+@pytest.fixture
+def app():
+    return app_module
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Паузы между ретраями не ждём, а записываем"""
+    recorded = []
+    monkeypatch.setattr(app_module.time, 'sleep', recorded.append)
+    return recorded
+
+
+@pytest.fixture(autouse=True)
+def reset_state(sleeps):
+    """Кэши и circuit breaker общие на процесс — каждый тест начинает с чистого листа"""
+    for store in (app_module.cache, app_module.cache_hits, app_module.failed_requests,
+                  app_module.serialized_bodies, app_module.product_bodies,
+                  app_module.compressed_bodies, app_module.request_stats):
+        store.clear()
+    app_module.drop_snapshot('categories_tree')
+    app_module.client._failure_times.clear()
+    app_module.client._circuit_open_until = 0.0
+
+
+@pytest.fixture
+def ocs(monkeypatch):
+    fake = FakeOCS()
+    monkeypatch.setattr(app_module.client.session, 'request', fake.request)
+    return fake
+
+
+@pytest.fixture
+def http(app):
+    return app.app.test_client()
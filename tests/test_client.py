@@ -0,0 +1,195 @@
+import threading
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+import requests
+
+from conftest import FakeResponse
+
+CITIES = ['Москва', 'Краснодар']
+
+
+def blocking_response(release, payload):
+    """Ответ OCS, который не приходит, пока тест не отпустит release"""
+    def respond(**kwargs):
+        release.wait(5)
+        return FakeResponse(200, payload)
+    return respond
+
+
+def wait_until(condition, timeout=5):
+    event = threading.Event()
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        event.wait(0.01)
+    raise AssertionError('condition not reached')
+
+
+def test_single_flight_coalesces_concurrent_misses(app, ocs):
+    release = threading.Event()
+    ocs.routes['/logistic/shipment/cities'] = blocking_response(release, CITIES)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(app.client.get_shipment_cities()))
+               for _ in range(5)]
+
+    threads[0].start()
+    wait_until(lambda: len(ocs.calls) == 1)
+    for thread in threads[1:]:
+        thread.start()
+    # Даём остальным потокам дойти до ожидания Future владельца
+    threading.Event().wait(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == [(CITIES, False)] * 5
+    assert len(ocs.calls) == 1
+
+
+def test_single_flight_waiter_gives_up_with_stale_copy(app, ocs, monkeypatch):
+    monkeypatch.setattr(app, 'SINGLE_FLIGHT_TIMEOUT', 0.05)
+    app.cache_set('shipment_cities', CITIES, timestamp=0)
+    release = threading.Event()
+    ocs.routes['/logistic/shipment/cities'] = blocking_response(release, ['Новые'])
+    owner = threading.Thread(target=app.client.get_shipment_cities)
+    owner.start()
+    wait_until(lambda: len(ocs.calls) == 1)
+
+    try:
+        assert app.client.get_shipment_cities() == (CITIES, True)
+    finally:
+        release.set()
+        owner.join(5)
+
+
+def test_single_flight_waiter_gives_up_with_error(app, ocs, monkeypatch):
+    monkeypatch.setattr(app, 'SINGLE_FLIGHT_TIMEOUT', 0.05)
+    release = threading.Event()
+    ocs.routes['/logistic/shipment/cities'] = blocking_response(release, CITIES)
+    owner = threading.Thread(target=app.client.get_shipment_cities)
+    owner.start()
+    wait_until(lambda: len(ocs.calls) == 1)
+
+    try:
+        data, stale = app.client.get_shipment_cities()
+        assert data == {'error': 'Upstream request still in progress after 0.05s'}
+        assert stale is False
+    finally:
+        release.set()
+        owner.join(5)
+
+
+def test_single_flight_owner_rechecks_cache(app):
+    # Запрос соседа успел заполнить кэш между нашим промахом и взятием ключа
+    app.cache_set('shipment_cities', CITIES)
+
+    def fetch():
+        raise AssertionError('OCS must not be called')
+
+    assert app.client._single_flight('shipment_cities', fetch, 'shipment_cities') == (CITIES, False)
+
+
+def responses(*items):
+    """Ответы OCS по очереди: FakeResponse или исключение"""
+    pending = list(items)
+
+    def respond(**kwargs):
+        item = pending.pop(0)
+        if isinstance(item, BaseException):
+            raise item
+        return item
+    return respond
+
+
+def fail_cities(app, times):
+    for _ in range(times):
+        app.client._make_request_with_retry('GET', '/logistic/shipment/cities', max_retries=0)
+
+
+def test_breaker_opens_after_failures_within_window(app, ocs):
+    ocs.respond('/logistic/shipment/cities', 503)
+
+    fail_cities(app, app.CIRCUIT_FAILURE_THRESHOLD)
+    calls = len(ocs.calls)
+
+    assert app.client.get_shipment_cities() == ({'error': 'OCS temporarily unavailable'}, False)
+    assert len(ocs.calls) == calls
+
+
+def test_breaker_ignores_failures_spread_beyond_window(app, ocs, monkeypatch):
+    ocs.respond('/logistic/shipment/cities', 503)
+    clock = [1000.0]
+    monkeypatch.setattr(app.time, 'time', lambda: clock[0])
+
+    for _ in range(app.CIRCUIT_FAILURE_THRESHOLD * 2):
+        fail_cities(app, 1)
+        clock[0] += app.CIRCUIT_WINDOW_SECONDS / (app.CIRCUIT_FAILURE_THRESHOLD - 1) + 1
+
+    assert app.client._circuit_open_until == 0.0
+
+
+def test_success_resets_breaker_failures(app, ocs):
+    ocs.respond('/logistic/shipment/cities', 503)
+    fail_cities(app, app.CIRCUIT_FAILURE_THRESHOLD - 1)
+    ocs.respond('/logistic/shipment/cities', 200, CITIES)
+    app.client._make_request_with_retry('GET', '/logistic/shipment/cities')
+    ocs.respond('/logistic/shipment/cities', 503)
+    fail_cities(app, app.CIRCUIT_FAILURE_THRESHOLD - 1)
+
+    assert app.client._circuit_open_until == 0.0
+
+
+def test_heavy_category_read_timeouts_do_not_open_breaker(app, ocs):
+    ocs.routes['/catalog/categories/V08/products'] = requests.exceptions.ReadTimeout()
+
+    for city in range(app.CIRCUIT_FAILURE_THRESHOLD + 1):
+        data, _ = app.client.get_products_by_category('V08', f'city{city}')
+        assert data == {'error': 'Request timeout after retries'}
+
+    assert app.client._circuit_open_until == 0.0
+
+
+def test_regular_category_read_timeouts_open_breaker(app, ocs):
+    ocs.routes['/catalog/categories/V01/products'] = requests.exceptions.ReadTimeout()
+
+    for city in range(app.CIRCUIT_FAILURE_THRESHOLD):
+        app.client.get_products_by_category('V01', f'city{city}')
+
+    assert app.client._circuit_open_until > 0
+
+
+def test_throttled_request_waits_for_retry_after(app, ocs, sleeps):
+    ocs.routes['/logistic/shipment/cities'] = responses(
+        FakeResponse(429, headers={'Retry-After': '2'}), FakeResponse(200, CITIES))
+
+    assert app.client.get_shipment_cities() == (CITIES, False)
+    assert sleeps == [2.0]
+
+
+def test_transient_errors_back_off_linearly(app, ocs, sleeps):
+    ocs.routes['/logistic/shipment/cities'] = responses(
+        FakeResponse(503), FakeResponse(408), FakeResponse(200, CITIES))
+
+    assert app.client.get_shipment_cities() == (CITIES, False)
+    assert sleeps == [0.5, 1.0]
+
+
+def test_long_retry_after_is_not_waited_for(app, ocs, sleeps):
+    ocs.respond('/logistic/shipment/cities', 429, headers={'Retry-After': str(app.MAX_RETRY_AFTER + 1)})
+
+    data, _ = app.client.get_shipment_cities()
+
+    assert data == {'error': 'Upstream HTTP 429', 'status_code': 429}
+    assert sleeps == []
+    assert len(ocs.calls) == 1
+
+
+def test_retry_after_accepts_http_date(app):
+    when = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=5), usegmt=True)
+
+    assert app.parse_retry_after(when) == pytest.approx(5, abs=1.5)
+    assert app.parse_retry_after(format_datetime(datetime(2000, 1, 1, tzinfo=timezone.utc), usegmt=True)) == 0.0
+    assert app.parse_retry_after('soon') is None
+    assert app.parse_retry_after(None) is None
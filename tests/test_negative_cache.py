@@ -0,0 +1,64 @@
+import logging
+
+CITIES = ['Москва', 'Краснодар']
+PRODUCTS = {'result': [{'id': i} for i in range(250)]}
+PRODUCTS_SUFFIX = '/catalog/categories/V01/products'
+PRODUCTS_PATH = '/api/categories/V01/products?shipmentcity=M'
+
+
+def expire(app, key):
+    data, _ = app.cache[key]
+    app.cache[key] = (data, 0)
+
+
+def test_failure_is_remembered_and_not_retried(http, ocs):
+    ocs.respond('/logistic/shipment/cities', 503)
+
+    first = http.get('/api/cities')
+    calls_after_first = len(ocs.calls)
+    second = http.get('/api/cities')
+
+    assert first.get_json() == {'error': 'Upstream HTTP 503'}
+    assert calls_after_first == 3  # первая попытка и два ретрая
+    assert second.get_json() == first.get_json()
+    assert len(ocs.calls) == calls_after_first
+
+
+def test_failure_over_stale_cache_is_remembered_too(app, http, ocs):
+    ocs.respond(PRODUCTS_SUFFIX, 200, PRODUCTS)
+    http.get(PRODUCTS_PATH)
+    key = next(key for key in app.cache if key.startswith('products_V01_M_'))
+    expire(app, key)
+    ocs.respond(PRODUCTS_SUFFIX, 503)
+
+    http.get(PRODUCTS_PATH)
+    calls = len(ocs.calls)
+    response = http.get(PRODUCTS_PATH)
+
+    assert response.headers['X-Cache'] == 'STALE'
+    assert len(response.get_json()['result']) == 250
+    assert len(ocs.calls) == calls
+
+
+def test_remembered_failure_expires(app, http, ocs):
+    ocs.respond('/logistic/shipment/cities', 503)
+    http.get('/api/cities')
+    error, _ = app.failed_requests['shipment_cities']
+    app.failed_requests['shipment_cities'] = (error, 0)
+    ocs.respond('/logistic/shipment/cities', 200, CITIES)
+
+    assert http.get('/api/cities').get_json() == CITIES
+
+
+def test_stale_fallback_is_logged_once_per_failure(app, http, ocs, caplog):
+    ocs.respond('/logistic/shipment/cities', 200, CITIES)
+    http.get('/api/cities')
+    expire(app, 'shipment_cities')
+    ocs.respond('/logistic/shipment/cities', 503)
+
+    with caplog.at_level(logging.WARNING, logger='app'):
+        for _ in range(5):
+            assert http.get('/api/cities').headers['X-Cache'] == 'STALE'
+
+    stale_warnings = [r for r in caplog.records if 'serving stale cache' in r.getMessage()]
+    assert len(stale_warnings) == 1
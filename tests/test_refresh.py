@@ -0,0 +1,34 @@
+import time
+
+import pytest
+
+CITIES = ['Москва', 'Краснодар']
+
+
+@pytest.fixture
+def due_entry(app, monkeypatch):
+    """Города в кэше, которым пора на refresh-ahead: до конца TTL меньше двух интервалов"""
+    monkeypatch.setattr(app, 'REFRESH_INTERVAL', 20)
+    app.cache_set('shipment_cities', CITIES, timestamp=time.time() - app.CACHE_TTLS['shipment_cities'] + 30)
+
+
+def test_unread_entry_is_not_refreshed(app, ocs, due_entry):
+    app._refresh_cache_once()
+
+    assert ocs.calls == []
+
+
+def test_read_entry_is_refreshed_once(app, ocs, due_entry):
+    ocs.respond('/logistic/shipment/cities', 200, ['Новые'])
+    assert app.cache_get('shipment_cities', 'shipment_cities') == CITIES
+
+    app._refresh_cache_once()
+    assert app.cache['shipment_cities'][0] == ['Новые']
+    assert len(ocs.calls) == 1
+
+    # Прошёл почти весь TTL обновлённой записи, а последнее чтение было до обновления
+    refreshed_at = time.time() - app.CACHE_TTLS['shipment_cities'] + 30
+    app.cache['shipment_cities'] = (['Новые'], refreshed_at)
+    app.cache_hits['shipment_cities'] = refreshed_at - 1
+    app._refresh_cache_once()
+    assert len(ocs.calls) == 1
@@ -0,0 +1,252 @@
+import threading
+
+import brotli
+import gzip
+
+from conftest import FakeResponse
+
+CITIES = ['Москва', 'Краснодар']
+PRODUCTS = {'result': [{'id': i} for i in range(250)]}
+PRODUCTS_SUFFIX = '/catalog/categories/V01/products'
+
+
+def expire(app, key):
+    """Делаем запись кэша протухшей, не трогая сами данные"""
+    data, _ = app.cache[key]
+    app.cache[key] = (data, 0)
+
+
+def test_cors_headers_expose_etag_and_x_cache(http, ocs):
+    ocs.respond('/logistic/shipment/cities', 200, CITIES)
+
+    response = http.get('/api/cities', headers={'Origin': 'https://shop.example'})
+
+    assert response.headers['Access-Control-Allow-Origin'] == '*'
+    assert response.headers['Access-Control-Allow-Headers'] == 'Content-Type,Authorization,X-API-Key'
+    assert response.headers['Access-Control-Expose-Headers'] == 'ETag, X-Cache'
+
+
+def test_preflight_is_answered_only_for_existing_routes(http, ocs):
+    preflight = http.open('/api/categories/V01/products', method='OPTIONS')
+    assert preflight.status_code == 204
+    assert preflight.headers['Access-Control-Max-Age'] == '86400'
+    assert preflight.get_data() == b''
+
+    unknown = http.open('/api/nope', method='OPTIONS')
+    assert unknown.status_code == 404
+    assert 'Access-Control-Max-Age' not in unknown.headers
+    assert ocs.calls == []
+
+
+def test_stale_cache_is_served_with_no_store_when_ocs_fails(app, http, ocs):
+    ocs.respond('/logistic/shipment/cities', 200, CITIES)
+    http.get('/api/cities')
+    expire(app, 'shipment_cities')
+    ocs.respond('/logistic/shipment/cities', 503)
+
+    response = http.get('/api/cities')
+
+    assert response.status_code == 200
+    assert response.get_json() == CITIES
+    assert response.headers['X-Cache'] == 'STALE'
+    assert response.headers['Cache-Control'] == 'no-store'
+
+
+def test_health_is_degraded_when_checks_are_served_from_stale_cache(app, http, ocs):
+    ocs.respond('/logistic/shipment/cities', 200, CITIES)
+    ocs.respond('/account/currencies/exchanges', 200, [{'usd': 90}])
+    assert http.get('/api/health').get_json()['status'] == 'healthy'
+    expire(app, 'shipment_cities')
+    expire(app, 'currency_exchanges')
+    ocs.respond('/logistic/shipment/cities', 503)
+    ocs.respond('/account/currencies/exchanges', 503)
+
+    response = http.get('/api/health')
+    body = response.get_json()
+
+    assert body['status'] == 'degraded'
+    assert body['checks']['cities_endpoint'] == 'stale'
+    assert body['checks']['currency_endpoint'] == 'stale'
+    assert response.headers['X-Cache'] == 'STALE'
+
+
+def test_reference_endpoint_answers_if_none_match_with_304(http, ocs):
+    ocs.respond('/logistic/shipment/cities', 200, CITIES)
+
+    first = http.get('/api/cities')
+    assert first.status_code == 200
+    assert first.headers['ETag']
+
+    second = http.get('/api/cities', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 304
+    assert second.get_data() == b''
+    assert http.get('/api/cities', headers={'If-None-Match': '"other"'}).status_code == 200
+    assert len(ocs.calls) == 1
+
+
+def test_compressed_product_body_is_memoized_per_encoding(app, http, ocs, monkeypatch):
+    ocs.respond(PRODUCTS_SUFFIX, 200, PRODUCTS)
+    compress_calls = []
+    real_compress = app.brotli.compress
+    monkeypatch.setattr(app.brotli, 'compress',
+                        lambda *args, **kwargs: compress_calls.append(1) or real_compress(*args, **kwargs))
+    path = '/api/categories/V01/products?shipmentcity=M'
+
+    first = http.get(path, headers={'Accept-Encoding': 'br'})
+    second = http.get(path, headers={'Accept-Encoding': 'br'})
+    gzipped = http.get(path, headers={'Accept-Encoding': 'gzip'})
+    plain = http.get(path, headers={'Accept-Encoding': 'identity'})
+
+    assert first.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(second.get_data()) == plain.get_data()
+    assert gzip.decompress(gzipped.get_data()) == plain.get_data()
+    assert len(compress_calls) == 1
+    assert len(app.compressed_bodies) == 2
+    # Сжатое тело отличается побайтно — ETag у него слабый
+    assert first.headers['ETag'] == f'W/{plain.headers["ETag"]}'
+    assert 'Content-Encoding' not in plain.headers
+
+
+def test_small_bodies_are_not_compressed(http):
+    response = http.get('/api/tips', headers={'Accept-Encoding': 'br'})
+
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_pagination_rejects_non_positive_page_and_per_page(http, ocs):
+    for path in ('/api/categories/V01/products/page/0?shipmentcity=M',
+                 '/api/categories/V01/products/page/1?shipmentcity=M&per_page=0',
+                 '/api/categories/V01/products/page/1?shipmentcity=M&per_page=-5'):
+        response = http.get(path)
+        assert response.status_code == 400, path
+        assert response.get_json() == {'error': 'page and per_page must be positive integers'}
+    assert ocs.calls == []
+
+
+def test_pagination_slices_cached_category(http, ocs):
+    ocs.respond(PRODUCTS_SUFFIX, 200, PRODUCTS)
+
+    response = http.get('/api/categories/V01/products/page/3?shipmentcity=M&per_page=100')
+    body = response.get_json()
+
+    assert response.status_code == 200
+    assert [p['id'] for p in body['result']] == list(range(200, 250))
+    assert body['pagination'] == {
+        'page': 3, 'per_page': 100, 'total': 250, 'total_pages': 3,
+        'has_next': False, 'has_prev': True,
+    }
+
+
+def prime_bootstrap(app):
+    app.cache_set('shipment_cities', CITIES)
+    app.cache_set('categories_light', [{'category': 'V01', 'name': 'Apple'}])
+    app.cache_set('currency_exchanges', {'USD': 90})
+
+
+def test_bootstrap_propagates_stale_section(app, http, ocs):
+    prime_bootstrap(app)
+    expire(app, 'shipment_cities')
+    ocs.respond('/logistic/shipment/cities', 503)
+
+    response = http.get('/api/bootstrap')
+    body = response.get_json()
+
+    assert response.status_code == 200
+    assert body['cities'] == CITIES
+    assert body['currency'] == {'USD': 90}
+    assert response.headers['X-Cache'] == 'STALE'
+    assert response.headers['Cache-Control'] == 'no-store'
+
+
+def test_bootstrap_returns_partial_payload_on_timeout(app, http, ocs, monkeypatch):
+    monkeypatch.setattr(app, 'BOOTSTRAP_TIMEOUT', 0.05)
+    prime_bootstrap(app)
+    expire(app, 'shipment_cities')
+    release = threading.Event()
+
+    def slow_cities(**kwargs):
+        release.wait(5)
+        return FakeResponse(200, CITIES)
+
+    ocs.routes['/logistic/shipment/cities'] = slow_cities
+    try:
+        body = http.get('/api/bootstrap').get_json()
+    finally:
+        release.set()
+        # Запрос владельца доходит в пуле после ответа — не даём ему писать в кэш следующего теста
+        future = app.client._inflight.get('shipment_cities')
+        if future is not None:
+            future.result(5)
+
+    assert body['cities'] == {'error': 'No response within 0.05s'}
+    assert body['categories'] == [{'category': 'V01', 'name': 'Apple'}]
+    assert body['currency'] == {'USD': 90}
+
+
+def test_multi_value_filters_are_forwarded_as_lists(http, ocs):
+    ocs.respond(PRODUCTS_SUFFIX, 200, PRODUCTS)
+
+    response = http.get('/api/categories/V01/products?shipmentcity=M'
+                        '&producers=A&producers=B&locations=X&includesale=true')
+
+    assert response.status_code == 200
+    params = ocs.params[-1]
+    assert params['producers'] == ['A', 'B']
+    assert params['locations'] == ['X']
+    assert params['includesale'] == 'true'
+
+
+def test_etag_is_computed_once_per_cached_object(app, http, ocs, monkeypatch):
+    ocs.respond('/account/currencies/exchanges', 200, {'USD': 90})
+    hashed = []
+    real_body_etag = app.body_etag
+    monkeypatch.setattr(app, 'body_etag', lambda body: hashed.append(body) or real_body_etag(body))
+
+    first = http.get('/api/currency')
+    second = http.get('/api/currency')
+
+    assert first.headers['ETag'] == second.headers['ETag']
+    assert len(hashed) == 1
+
+
+def test_etag_changes_when_cached_data_changes(app, http, ocs):
+    ocs.respond('/account/currencies/exchanges', 200, {'USD': 90})
+    old_etag = http.get('/api/currency').headers['ETag']
+
+    expire(app, 'currency_exchanges')
+    ocs.respond('/account/currencies/exchanges', 200, {'USD': 91})
+    response = http.get('/api/currency', headers={'If-None-Match': old_etag})
+
+    assert response.status_code == 200
+    assert response.get_json() == {'USD': 91}
+    assert response.headers['ETag'] != old_etag
+
+
+def test_successful_reference_response_is_cacheable(app, http, ocs):
+    ocs.respond('/logistic/shipment/cities', 200, CITIES)
+
+    response = http.get('/api/cities')
+
+    assert response.headers['Cache-Control'] == app.REFERENCE_CACHE_CONTROL
+    assert 'X-Cache' not in response.headers
+
+
+def test_error_reference_response_is_not_cacheable(http, ocs):
+    ocs.respond('/logistic/shipment/cities', 503)
+
+    response = http.get('/api/cities')
+
+    assert response.get_json() == {'error': 'Upstream HTTP 503'}
+    assert 'Cache-Control' not in response.headers
+
+
+def test_fallback_categories_are_served_with_no_store(app, http, ocs):
+    ocs.respond('/catalog/categories', 503)
+
+    response = http.get('/api/categories/light')
+
+    assert response.status_code == 200
+    assert response.get_json() == app.FALLBACK_CATEGORIES_LIGHT
+    assert response.get_json()
+    assert response.headers['Cache-Control'] == 'no-store'
+    assert 'categories_light' not in app.cache
@@ -0,0 +1,102 @@
+import os
+import stat
+
+import pytest
+
+fcntl = pytest.importorskip('fcntl')
+
+TREE = [{'category': 'V01', 'name': 'Apple'}]
+
+
+@pytest.fixture
+def held_lock(app):
+    """Блокировку снапшота держит «другой воркер» — отдельный дескриптор файла"""
+    fd = os.open(app._snapshot_path('categories_tree', 'lock'), os.O_WRONLY | os.O_CREAT, 0o600)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    yield
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+def test_tree_is_read_from_snapshot_written_by_another_worker(app, ocs):
+    app.write_snapshot('categories_tree', TREE)
+
+    assert app.client.get_categories_tree() == (TREE, False)
+    assert ocs.calls == []
+
+
+def test_fetched_tree_is_written_to_snapshot(app, ocs):
+    ocs.respond('/catalog/categories', 200, TREE)
+
+    app.client.get_categories_tree()
+
+    data, _ = app.read_snapshot('categories_tree', 60)
+    assert data == TREE
+
+
+def test_failure_marker_stops_other_workers_from_refetching(app, ocs):
+    ocs.respond('/catalog/categories', 503)
+    error, stale = app.client.get_categories_tree()
+    calls = len(ocs.calls)
+    assert error == {'error': 'Upstream HTTP 503'} and not stale
+    assert app.read_snapshot('categories_tree', app.NEGATIVE_CACHE_TTL, 'failed') is not None
+
+    # Другой воркер: своего негативного кэша у него нет, только метка на диске
+    app.failed_requests.clear()
+    assert app.client.get_categories_tree() == (error, False)
+    assert len(ocs.calls) == calls
+
+
+def test_lock_wait_is_bounded(app, ocs, held_lock, monkeypatch):
+    monkeypatch.setattr(app, 'SNAPSHOT_LOCK_TIMEOUT', 0.05)
+
+    with app.snapshot_lock('categories_tree') as locked:
+        assert locked is False
+
+    assert app.client.get_categories_tree() == ({'error': 'Categories tree is still loading'}, False)
+    assert ocs.calls == []
+
+
+def test_cache_clear_drops_snapshot_and_failure_marker(app, http):
+    app.write_snapshot('categories_tree', TREE)
+    app.write_snapshot('categories_tree', {'error': 'x'}, 'failed')
+
+    http.get('/api/cache/clear')
+
+    assert not os.path.exists(app._snapshot_path('categories_tree'))
+    assert not os.path.exists(app._snapshot_path('categories_tree', 'failed'))
+
+
+def test_default_snapshot_dir_is_private(app, monkeypatch, tmp_path):
+    monkeypatch.delenv('OCS_SNAPSHOT_DIR')
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path))
+
+    path = app._private_snapshot_dir()
+
+    assert os.path.dirname(path) == str(tmp_path)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o700
+
+
+def test_planted_shared_dir_is_not_used(app, monkeypatch, tmp_path):
+    monkeypatch.delenv('OCS_SNAPSHOT_DIR')
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path))
+    planted = app._private_snapshot_dir()
+    os.chmod(planted, 0o777)
+
+    path = app._private_snapshot_dir()
+
+    assert path != planted
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o700
+
+
+def test_lock_file_symlink_is_not_followed(app, tmp_path):
+    target = tmp_path / 'victim'
+    target.write_text('keep')
+    link = app._snapshot_path('planted', 'lock')
+    os.symlink(target, link)
+    try:
+        with app.snapshot_lock('planted') as locked:
+            assert locked is True  # блокировку не взяли, но и чужой файл не тронули
+        assert target.read_text() == 'keep'
+    finally:
+        os.remove(link)